@@ -9,7 +9,7 @@ sys.path.append(BASE_DIR)
 
 from ordering.utils.redcap import init_project, get_redcap_report, get_cascadia_study_pause_reports
 from ordering.utils.common import USPS_EXPORT_COLS, LOGISTICS_S3_BUCKET, LOGISTICS_USPS_PATH, export_orders
-from ordering.utils.cascadia import append_order, get_household_address, participant_under_study_pause, household_needs_resupply, get_participant_kit_count
+from ordering.utils.cascadia import append_order, build_household_addresses, get_household_address, participant_under_study_pause, household_needs_resupply, get_participant_kit_count
 
 # Set up envdir
 envdir.open(os.path.join(BASE_DIR, '.env/redcap'))
@@ -25,10 +25,20 @@ def main(args):
     serial_report = get_redcap_report(project, PROJECT, '1711')
     pause_report = get_cascadia_study_pause_reports(project)
 
+    # parse symptom survey dates once up front rather than within each household.
+    # The date format of report 1144 is not pinned, so infer it and raise on anything
+    # unparseable rather than coercing to NaT and silently using an older address.
+    order_report['ss_date_1'] = pd.to_datetime(order_report['ss_date_1'], cache=True)
+
+    # repeat instruments are compared for every participant, so store them as categories
+    order_report['redcap_repeat_instrument'] = order_report['redcap_repeat_instrument'].astype('category')
+
     serial_pts = serial_report['results_ptid'] if len(serial_report) else []
     LOG.debug(f'Operating with <{len(serial_report)}> serial patients.')
 
-    orders = pd.DataFrame(columns=USPS_EXPORT_COLS)
+    order_parts = []
+    order_ids = set()
+    household_addresses = build_household_addresses(order_report)
     household_ids = set(i[0] for i in order_report.index)
 
     for house_id in household_ids:
@@ -90,19 +100,26 @@ def main(args):
 
 
         if kits_needed['welcome'] or kits_needed['resupply'] or kits_needed['serial']:
-            address = get_household_address(order_report, house_id)
+            address = get_household_address(household_addresses, house_id)
 
         if kits_needed['resupply']:
             resupply_kits_needed = sum(kits_needed['resupply'].values())
-            orders = append_order(orders, house_id, 1, resupply_kits_needed, address)
+            order_parts.append(append_order(house_id, 1, resupply_kits_needed, address, order_ids))
 
         if kits_needed['serial']:
             for pt, _ in kits_needed['serial'].items():
-                orders = append_order(orders, house_id, 2, 1, address)
+                order_parts.append(append_order(house_id, 2, 1, address, order_ids))
 
         if kits_needed['welcome']:
             welcome_kits_needed = sum(kits_needed['welcome'].values())
-            orders = append_order(orders, house_id, 3, welcome_kits_needed, address)
+            order_parts.append(append_order(house_id, 3, welcome_kits_needed, address, order_ids))
+
+    # concatenate orders once. `append_order` returns None for households without
+    # a valid address, so those are skipped here.
+    orders = pd.concat(
+        [pd.DataFrame(columns=USPS_EXPORT_COLS)] + [part for part in order_parts if part is not None],
+        join='inner', ignore_index=True
+    )
 
     LOG.info(f"Summary of orders generated by this run: \n \
             {orders.groupby(['Project Name']).size().reset_index(name='counts')}")
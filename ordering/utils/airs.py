@@ -1,6 +1,6 @@
 """order utilities for the AIRS project"""
 import logging
-from .common import use_best_address
+from .common import use_best_addresses
 
 AIRS_ORDER_FIELDS = [
     "Order Date", "Today Tomorrow", "Street Address 2", "Apt Number 2",
@@ -48,16 +48,15 @@ def filter_airs_orders(orders):
         like='week', axis=0
     ).dropna(subset=['Order Date', 'Order Date 2'], how='all'
     ).reset_index(level='redcap_event_name'
-    ).query("~index.duplicated(keep='last')"
-    ).set_index('redcap_event_name', append=True)
+    ).loc[
+        lambda records: ~records.index.duplicated(keep='last')
+    ].set_index('redcap_event_name', append=True)
 
     # Determine what AIRS order to use (up to 2 weekly orders are allowed for AIRS)
     orders.loc[:, AIRS_ORDER_FIELDS] = orders.apply(determine_airs_order, axis=1)
 
     # Get the most recent address supplied by the participant
-    orders = orders.apply(
-        lambda row: use_best_address(original_address, row, 'screening_and_enro_arm_1'), axis=1
-    )
+    orders = use_best_addresses(original_address, orders, 'screening_and_enro_arm_1')
 
     LOG.info(f'<{len(orders)}> orders remain for AIRS after filtering.')
     return orders
@@ -1,7 +1,8 @@
 """order utilities for the Cascadia project"""
 import logging, datetime
+import numpy as np
 import pandas as pd
-from .common import USPS_EXPORT_COLS, use_best_address
+from .common import USPS_EXPORT_COLS, CORE_ADDRESS_COLS, REPLACEMENT_ADDRESS_COLS, use_best_addresses
 
 LOG = logging.getLogger(__name__)
 
@@ -10,19 +11,22 @@ PROJECT_NAME_MAP = {
     2: 'Cascadia_SEA'
 }
 
+# Max kits of a given SKU which may be sent in a single shipment
+MAX_SHIPMENT_KITS = {
+    1: 20,  # replenishment kits
+    3: 4    # welcome kits
+}
+
 BARCODE_COLUMNS = [f'assign_barcode_{i}' for i in range(1, 10)]
 
 
 def assign_cascadia_location(orders):
     '''Assign orders to the desired Cascadia sublocation'''
     LOG.debug(f'Assigning Cascadia sublocations to each order record.')
-    orders['Project Name'] = orders[['Project Name']].apply(
-        lambda x: 'CASCADIA_SEA' if x['Project Name'] == 2 else 'CASCADIA_PDX', axis=1
+    orders['Project Name'] = np.where(
+        orders['Project Name'].eq(2), 'CASCADIA_SEA', 'CASCADIA_PDX'
     )
 
-    # ensure that we convert column type from int to str
-    orders['Project Name'] = orders['Project Name'].astype(str)
-
     return orders
 
 
@@ -32,25 +36,23 @@ def filter_cascadia_orders(orders, enrollments):
 
     # apply the project name mapping to each enrollment record. by default
     # it only appears on the first record.
-    enrollments['Project Name'] = enrollments.apply(
-        lambda x: enrollments.filter(
-            items=[(x.name[0], '0_arm_1')], axis=0
-        )['Project Name'].values[0],axis=1
-    )
+    project_names = enrollments.xs('0_arm_1', level=1)['Project Name']
+    project_names = project_names[~project_names.index.duplicated(keep='first')]
+    enrollments['Project Name'] = enrollments.index.get_level_values(0).map(project_names)
 
     # Orders we must fulfill are symptom surveys without an existing tracking number
     # which have a designated pickup time and have a completed symptom survey.
     # We can also drop records which do not have a order date.
-    orders = orders[
+    mask = (
         (orders['redcap_repeat_instrument'] == 'symptom_survey') &
-        (orders['ss_return_tracking'].isna()) &
-        any(orders[['Pickup 1', 'Pickup 2']].notna()) &
+        orders['ss_return_tracking'].isna() &
+        orders[['Pickup 1', 'Pickup 2']].notna().any(axis=1) &
         (orders['symptom_survey_complete'] == 2)
-    ].dropna(subset=['Order Date']
-    ).apply(lambda record: use_best_address(enrollments, record), axis=1)
+    )
+    orders = use_best_addresses(enrollments, orders[mask].dropna(subset=['Order Date']))
 
     # Set today tomorrow variable based on pickup time preference
-    orders['Today Tomorrow'] = orders[['Pickup 1']].apply(lambda x: 0 if x['Pickup 1'] == 1 else 1, axis=1)
+    orders['Today Tomorrow'] = (orders['Pickup 1'] != 1).astype('int8')
     orders['Notification Pref'] = 'email'
 
     orders = assign_cascadia_location(orders)
@@ -58,162 +60,202 @@ def filter_cascadia_orders(orders, enrollments):
     LOG.info(f'<{len(orders)}> orders remain for Cascadia after filtering.')
     return orders
 
-def append_order(orders, household, sku, quantity, address):
+def append_order(household, sku, quantity, address, order_ids):
     """
-    Append household orders to the broader order form
+    Create household orders to append to the broader order form. Returns `None`
+    if the household has no valid address.
     """
     # don't append orders lacking a valid address
     if any(pd.isna(address['Street Address'])) and any(pd.isna(address['City'])) and any(pd.isna(address['State'])):
         LOG.warning(f'No valid address for household <{household}>. Skipping order.')
-        return orders
+        return None
 
-    if quantity > 20 and sku == 1:  # seperate replenishment kits into other order becaues of max shippment size
-        LOG.debug(f'Splitting resupply order for household <{household}> because needed kits > 20.')
-        orders = append_order(orders, household, sku, quantity - 20, address)
-        quantity = 20
-    elif quantity > 4 and sku == 3:  # seperate welcome kits into other order because of max shippment size
-        LOG.debug(f'Splitting welcome order for household <{household}> because welcome kits > 4.')
-        orders = append_order(orders, household, sku, quantity - 4, address)
-        quantity = 4
+    # seperate kits into multiple orders because of max shipment size
+    max_kits = MAX_SHIPMENT_KITS.get(sku, quantity)
+    if quantity > max_kits:
+        LOG.debug(f'Splitting order of kit type <{sku}> for household <{household}> because needed kits > {max_kits}.')
+        full_orders, remainder = divmod(quantity, max_kits)
+        quantities = ([remainder] if remainder else []) + [max_kits] * full_orders
+    else:
+        quantities = [quantity]
 
-    address['SKU'] = sku
-    address['Quantity'] = quantity
-    address['OrderID'] = generate_order_number(orders, household)
-    address['Household ID'] = household
+    orders = address.loc[address.index.repeat(len(quantities))].assign(
+        SKU=sku,
+        Quantity=quantities,
+        OrderID=[generate_order_number(order_ids, household) for _ in quantities],
+        **{'Household ID': household}
+    )
 
-    LOG.info(f'Appending order with <{quantity}> kits of type <{sku}> destined for household <{household}>.')
-    return pd.concat([orders, address], join='inner', ignore_index=True)
+    LOG.info(f'Appending <{len(quantities)}> orders with <{quantities}> kits of type <{sku}> destined for household <{household}>.')
+    return orders[orders.columns.intersection(USPS_EXPORT_COLS)]
 
 
-def get_household_address(household_records, house_id):
-    """Get the most up to date address from a household"""
-    enroll_address = get_enrollment_address(household_records.loc[house_id], house_id).reset_index()
-    updated_address = get_most_recent_address(household_records.loc[house_id], house_id)
+def build_household_addresses(household_records):
+    """Get the most up to date address for every household"""
+    LOG.debug(f'Building addresses for <{household_records.index.get_level_values(0).nunique()}> households.')
+    enroll_addresses = get_enrollment_addresses(household_records)
+    updated_addresses = get_most_recent_addresses(household_records)
 
-    # use the more recent symptom survey address if one exists. We have to reset the index since
-    # these can be a combo of participants depending on who the head of household might be.
-    address = enroll_address if updated_address is None else updated_address.reset_index()
+    # use the more recent symptom survey address if one exists. Otherwise fall back on
+    # the head of household enrollment address.
+    addresses = pd.concat([
+        updated_addresses,
+        enroll_addresses[~enroll_addresses.index.isin(updated_addresses.index)]
+    ])
+    enroll_addresses = enroll_addresses.reindex(addresses.index)
 
     # always use original delivery instructions, email, phone, and last name
     # since symptom survey occassionally does not have these fields
-    address['Pref First Name']       = get_best_first_name(enroll_address)
-    address['Last Name']             = enroll_address['Last Name']
-    address['Email']                 = enroll_address['Email']
-    address['Phone']                 = enroll_address['Phone']
-    address['Delivery Instructions'] = enroll_address['Delivery Instructions']
+    addresses['Pref First Name']       = get_best_first_names(enroll_addresses)
+    addresses['Last Name']             = enroll_addresses['Last Name']
+    addresses['Email']                 = enroll_addresses['Email']
+    addresses['Phone']                 = enroll_addresses['Phone']
+    addresses['Delivery Instructions'] = enroll_addresses['Delivery Instructions']
+
+    addresses['Project Name'] = find_and_map_project_assignments(household_records).reindex(addresses.index)
+    addresses['Zipcode'] = addresses['Zipcode'].astype('Int64')
 
-    address['Project Name'] = find_and_map_project_assignment(household_records.loc[house_id], house_id)
-    address['Zipcode'] = address['Zipcode'].astype(int) if not pd.isna(address['Zipcode'].values) else ''
+    return addresses[addresses.columns.intersection(USPS_EXPORT_COLS)]
 
-    return address[address.columns.intersection(USPS_EXPORT_COLS)]
 
+def get_household_address(household_addresses, house_id):
+    """Get the most up to date address from a household"""
+    LOG.debug(f'Looking up address for household <{house_id}>.')
+    return household_addresses.reindex([house_id]).reset_index(drop=True)
 
-def get_most_recent_address(household_records, house_id):
-    """Get the most recent address provided by a household"""
-    LOG.debug(f'Trying to select the most recent symptom survey address within household <{house_id}>.')
 
-    # get a households symptom surveys, which may hold additional addresses
-    symptom_surveys = household_records[household_records['redcap_repeat_instrument'] == 'symptom_survey'].copy()
-    symptom_surveys['ss_date_1'] = symptom_surveys['ss_date_1'].astype('datetime64')
+def get_most_recent_addresses(household_records):
+    """
+    Get the most recent address provided by each household. Expects `ss_date_1`
+    to already be parsed as a datetime.
+    """
+    LOG.debug(f'Trying to select the most recent symptom survey address within each household.')
 
-    # sort symptom survey by most recently completed
+    # get the symptom surveys, which may hold additional addresses
     # note: we assume non-empty values for `Street Address 2`, `City 2`, and `State 2`
     # implies a 'complete' address. The appended `2` indicates the value is from the
     # symptom survey and not the enrollment survey
-    symptom_surveys = symptom_surveys.sort_values(by='ss_date_1', ascending = False)
-    complete_addresses = symptom_surveys[
+    complete_addresses = household_records[
+                            (household_records['redcap_repeat_instrument'] == 'symptom_survey') &
                             ~(
-                                (pd.isna(symptom_surveys['Street Address 2'])) &
-                                (pd.isna(symptom_surveys['City 2'])) &
-                                (pd.isna(symptom_surveys['State 2']))
+                                (pd.isna(household_records['Street Address 2'])) &
+                                (pd.isna(household_records['City 2'])) &
+                                (pd.isna(household_records['State 2']))
                             )
-                        ].copy()
+                        ]
 
-    if not complete_addresses.empty:
-        LOG.debug(f'Address found within participant symptom surveys, updating participant address.')
-        complete_addresses['Street Address'] = complete_addresses['Street Address 2']
-        complete_addresses['Apt Number'] = complete_addresses['Apt Number 2']
-        complete_addresses['City'] = complete_addresses['City 2']
-        complete_addresses['State'] = complete_addresses['State 2']
-        complete_addresses['Zipcode'] = complete_addresses['Zipcode 2']
+    # keep the most recently completed symptom survey in each household. Surveys
+    # missing a completion date are only used if no others exist, since NaT is the
+    # smallest int64 timestamp.
+    household_codes, _ = pd.factorize(complete_addresses.index.get_level_values(0))
+    survey_dates = complete_addresses['ss_date_1'].to_numpy(dtype='datetime64[ns]').view('int64')
+    most_recent = complete_addresses.iloc[
+        select_most_recent(household_codes, survey_dates)
+    ].droplevel(1)
+
+    # replace the address on the selected surveys only
+    LOG.debug(f'Address found within symptom surveys for <{len(most_recent)}> households.')
+    return most_recent.assign(**{
+        core: most_recent[replacement] for core, replacement in zip(CORE_ADDRESS_COLS, REPLACEMENT_ADDRESS_COLS)
+    })
 
-        return complete_addresses.iloc[[0]]
-    else:
-        LOG.debug(f'No symptom survey address found, using Head of Household enrollment address.')
-        return None
 
+def select_most_recent(group_codes, timestamps):
+    """
+    Get the position of the latest of `timestamps` within each of the integer
+    `group_codes`. Ties are broken by the earliest position.
+    """
+    positions = np.arange(len(group_codes))
 
-def find_and_map_project_assignment(household_records, house_id):
-    """Gets the project name for a given household"""
-    project_name = int(household_records.query('`Project Name`.notna()')['Project Name'].values)
-    project_name = PROJECT_NAME_MAP.get(project_name, None)
+    # sort by group, then timestamp, then descending position so the last row of
+    # each group is its most recent
+    order = np.lexsort((-positions, timestamps, group_codes))
+    sorted_codes = group_codes[order]
+
+    group_ends = np.ones(len(order), dtype=bool)
+    group_ends[:-1] = sorted_codes[1:] != sorted_codes[:-1]
+    return order[group_ends]
 
-    if project_name:
-        LOG.debug(f'Assigned project <{project_name}> to househould <{house_id}>.')
-    else:
-        LOG.warning(f'No valid project found for household <{house_id}>.')
 
-    return project_name
+def find_and_map_project_assignments(household_records):
+    """Gets the project name for every household"""
+    project_names = household_records['Project Name'].dropna().groupby(level=0).first()
+    project_names = project_names.astype(int).map(PROJECT_NAME_MAP)
 
+    missing = household_records.index.get_level_values(0).unique().difference(project_names.dropna().index)
+    if not missing.empty:
+        LOG.warning(f'No valid project found for households <{list(missing)}>.')
 
-def get_enrollment_address(household_records, house_id):
+    return project_names
+
+
+def get_enrollment_addresses(household_records):
     """
-    Get the address from the head of household in a passed household's
+    Get the address from the head of household in each household's
     enrollment event.
     """
-    head_of_house_idx = get_head_of_household(household_records, house_id)
+    head_of_house_idx = build_head_of_household_map(household_records)
 
-    LOG.debug(f'Fetching Head of Household enrollment address at index <{head_of_house_idx}> for household <{house_id}>.')
-    return household_records.loc[[f'{head_of_house_idx}_arm_1']].query('redcap_repeat_instrument.isna()')
+    LOG.debug(f'Fetching Head of Household enrollment addresses for <{len(head_of_house_idx)}> households.')
+    enrollments = household_records[household_records['redcap_repeat_instrument'].isna()]
+    enrollments = enrollments[~enrollments.index.duplicated(keep='first')]
 
+    return enrollments.reindex(pd.MultiIndex.from_arrays([
+        head_of_house_idx.index, head_of_house_idx.astype(str) + '_arm_1'
+    ])).droplevel(1)
 
-def generate_order_number(orders, house_id):
-    """Generates a unique order number from the date and house id"""
-    order_id = f'{datetime.datetime.now().strftime("%y%m%d")}_{house_id}'
-    while order_id in orders['OrderID'].values:
-        if (not order_id[len(order_id) - 1].isalpha()):
-            order_id = order_id + 'a'
-        else:
-            l = list(order_id)
-            l[len(l) - 1] = chr(ord(l[len(l) - 1]) + 1)
-            order_id = ''.join(l)
 
+def generate_order_number(order_ids, house_id):
+    """
+    Generates a unique order number from the date and house id. The new order
+    number is added to the set of already issued `order_ids`.
+    """
+    prefix = f'{datetime.datetime.now().strftime("%y%m%d")}_{house_id}'
+    order_id, attempt = prefix, 0
+    while order_id in order_ids:
+        attempt += 1
+        order_id = prefix + order_number_suffix(attempt)
+
+    order_ids.add(order_id)
     LOG.debug(f'Generated unique order_id <{order_id}>.')
     return order_id
 
 
-def get_best_first_name(enroll_address):
+def order_number_suffix(attempt):
+    """
+    Converts a positive `attempt` number to a lowercase letter suffix, counting
+    a to z and then aa, ab, and so on.
+    """
+    suffix = ''
+    while attempt > 0:
+        attempt, remainder = divmod(attempt - 1, 26)
+        suffix = chr(ord('a') + remainder) + suffix
+
+    return suffix
+
+
+def get_best_first_names(enroll_addresses):
     '''
-    Return the preferred first name of the participant if it exists or their
+    Return the preferred first name of each participant if it exists or their
     full first name if it does not.
     '''
-    pref_first_name = enroll_address.iloc[0]['Pref First Name']
-    if not pd.isna(pref_first_name):
-        LOG.debug(f'Using participant preferred first name.')
-        return pref_first_name
-    else:
-        LOG.debug(f'Using participant legal first name.')
-        return enroll_address.iloc[0]['First Name']
+    return enroll_addresses['Pref First Name'].fillna(enroll_addresses['First Name'])
 
 
-def get_head_of_household(household_records, house_id):
-    """Gets the head of household index for a given household"""
+def build_head_of_household_map(household_records):
+    """Gets the head of household index for every household"""
 
-    # get the head of house id, which is the first non NaN value in this household's data set.
-    # We have to reset the index to avoid a duplicated index error and then grab the index of the
-    # actual head of house record based on the head of house id
-    tmp = household_records.copy()
-    tmp.reset_index(level=0, inplace=True)
-    head_of_house_idx = tmp.iloc[tmp["HH Reporter"].notna().idxmax()]['HH Reporter']
+    # get the head of house id, which is the first non NaN value in each household's data set.
+    head_of_house_idx = household_records['HH Reporter'].dropna().groupby(level=0).first().astype(int)
 
     # Fallback on the first participant in a household if there is no head of household set
-    if pd.isna(head_of_house_idx):
-        head_of_house_idx = 0
-        LOG.warning(f"No Head of Household detected for household <{house_id}>, falling back to index <{head_of_house_idx}>.")
-    else:
-        LOG.debug(f"Found index <{int(head_of_house_idx)}> to be the head of household for household <{house_id}>.")
+    households = household_records.index.get_level_values(0).unique()
+    missing = households.difference(head_of_house_idx.index)
+    if not missing.empty:
+        LOG.warning(f"No Head of Household detected for households <{list(missing)}>, falling back to index <0>.")
 
-    return int(head_of_house_idx)
+    LOG.debug(f"Found head of household indices for <{len(head_of_house_idx)}> households.")
+    return head_of_house_idx.reindex(households, fill_value=0)
 
 
 def participant_under_study_pause(study_pauses, household_id, participant_index):
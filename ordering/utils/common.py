@@ -34,42 +34,46 @@ REPLACEMENT_METADATA = [
 ]
 
 
-def use_best_address(enrollment_records, replacement_record, event=''):
+def use_best_addresses(enrollment_records, replacement_records, event=''):
     '''
-    if there is not a replacement address use the original address for a
-    specific order. Orders are filtered based on record_id and event. A custom
-    event may be specified
+    If there is not a replacement address use the original address for each
+    order. Orders are joined to their enrollment records based on record_id and
+    event. A custom event may be specified
     '''
-
-    # grab the index we need to update on and filter enrollment records by this index to get the
-    # enrollment associated with this row/participant.
-    record_index = replacement_record.name if not event else (replacement_record.name[0], event)
-    LOG.debug(f'Determining best address for record {record_index}')
-
-    enrollment_record = enrollment_records.filter(items=[record_index], axis=0).squeeze(axis=0)
-    updated_record = replacement_record.copy()
-
-    # If all replacement address columns exist and they are not null, use those fields.
-    # Otherwise we should use the address in the enrollment record.
-    if set(REPLACEMENT_ADDRESS_COLS).issubset(replacement_record.index) and replacement_record[REPLACEMENT_ADDRESS_COLS].notnull().any():
-        LOG.debug(f'Replacing enrollment address with replacement address on record <{record_index}>')
-        updating = True
-        replacement_columns = REPLACEMENT_ADDRESS_COLS
+    LOG.debug(f'Determining best address for <{len(replacement_records)}> records')
+
+    # line each record up with its enrollment record. Only the first enrollment record
+    # is used for any index appearing more than once.
+    record_index = replacement_records.index if not event else pd.MultiIndex.from_arrays([
+        replacement_records.index.get_level_values(0), [event] * len(replacement_records)
+    ])
+    enrollment = enrollment_records[
+        ~enrollment_records.index.duplicated(keep='first')
+    ].reindex(record_index).set_axis(replacement_records.index, axis=0)
+    updated_records = replacement_records.copy()
+
+    # Use the replacement address on records where any replacement address field is
+    # not null. Otherwise we should use the address in the enrollment record.
+    if set(REPLACEMENT_ADDRESS_COLS).issubset(replacement_records.columns):
+        updating = replacement_records[REPLACEMENT_ADDRESS_COLS].notnull().any(axis=1)
     else:
-        LOG.debug(f'Using original enrollment address, no valid replacement address, on record <{record_index}>')
-        updating = False
-        replacement_columns = CORE_ADDRESS_COLS
+        updating = pd.Series(False, index=replacement_records.index)
 
-    # Replace address with the best one found
-    for core, replacement in zip(CORE_ADDRESS_COLS, replacement_columns):
-        updated_record[core] = replacement_record.loc[replacement] if updating else enrollment_record.loc[replacement]
+    LOG.debug(f'Replacing enrollment address with replacement address on <{updating.sum()}> records')
+    for core, replacement in zip(CORE_ADDRESS_COLS, REPLACEMENT_ADDRESS_COLS):
+        updated_records[core] = enrollment[core].mask(updating, replacement_records.get(replacement))
 
     # Fill any empty metadata fields with existing values in original enrollment record
     for replacement in REPLACEMENT_METADATA:
-        updated_metadata = replacement_record.get(replacement, pd.NA)
-        updated_record[replacement] = updated_metadata if not pd.isna(updated_metadata) else enrollment_record.get(replacement)
-
-    return updated_record
+        original = enrollment.get(replacement)
+        if replacement in replacement_records:
+            updated_records[replacement] = replacement_records[replacement].where(
+                replacement_records[replacement].notna(), original
+            )
+        else:
+            updated_records[replacement] = original
+
+    return updated_records
 
 
 def format_id(orders, project, new_index = None):
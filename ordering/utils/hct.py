@@ -1,6 +1,6 @@
 """order utilities for the HCT project"""
 import logging
-from .common import use_best_address
+from .common import use_best_addresses
 
 LOG = logging.getLogger(__name__)
 
@@ -19,10 +19,10 @@ def filter_hct_orders(orders):
     orders = orders.filter(
         like='encounter_arm_1', axis=0
     ).dropna(subset=['Order Date']
-    ).query("~index.duplicated(keep='last')"
-    ).apply(
-        lambda row: use_best_address(original_address, row, 'enrollment_arm_1'), axis=1
-    )
+    ).loc[
+        lambda records: ~records.index.duplicated(keep='last')
+    ]
+    orders = use_best_addresses(original_address, orders, 'enrollment_arm_1')
 
     LOG.info(f'<{len(orders)}> orders remain for HCT after filtering.')
     return orders
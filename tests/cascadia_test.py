@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+
+import datetime as real_datetime
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+
+# pylint: disable=import-error, wrong-import-position
+import ordering.utils.cascadia as cascadia
+from ordering.utils.common import USPS_EXPORT_COLS
+
+
+class TestFilterCascadiaOrders(unittest.TestCase):
+
+    def setUp(self):
+        index = pd.MultiIndex.from_tuples([(1, '0_arm_1'), (2, '0_arm_1'),
+                                           (3, '0_arm_1')])
+        address = {
+            'Street Address': ['1 Main St', '2 Main St', '3 Main St'],
+            'Apt Number': [None] * 3,
+            'City': ['Seattle'] * 3,
+            'State': ['WA'] * 3,
+            'Zipcode': [98101] * 3,
+            'First Name': ['A', 'B', 'C'],
+            'Last Name': ['X', 'Y', 'Z'],
+            'Email': [None] * 3,
+            'Phone': [None] * 3,
+            'Notification Pref': [None] * 3,
+        }
+        self.enrollments = pd.DataFrame(dict(address, **{'Project Name': [2, 1, 1]}),
+                                        index=index)
+        self.orders = pd.DataFrame(
+            {
+                'redcap_repeat_instrument': ['symptom_survey'] * 3,
+                'ss_return_tracking': [None] * 3,
+                'Pickup 1': [1, None, None],
+                'Pickup 2': [None, 1, None],
+                'symptom_survey_complete': [2] * 3,
+                'Order Date': ['2022-05-06'] * 3,
+                'Project Name': [None] * 3,
+            },
+            index=index)
+
+    def test_orders_without_pickup_are_dropped(self):
+        orders = cascadia.filter_cascadia_orders(self.orders, self.enrollments)
+
+        self.assertEqual(list(orders.index.get_level_values(0)), [1, 2])
+        self.assertEqual(list(orders['Street Address']), ['1 Main St', '2 Main St'])
+        self.assertEqual(list(orders['Today Tomorrow']), [0, 1])
+        self.assertEqual(list(orders['Project Name']), ['CASCADIA_SEA', 'CASCADIA_PDX'])
+
+
+class TestAppendOrder(unittest.TestCase):
+
+    def setUp(self):
+        self.address = pd.DataFrame([{col: 'x' for col in USPS_EXPORT_COLS}])
+
+    def test_oversized_orders_are_split(self):
+        orders = cascadia.append_order(1, 1, 45, self.address, set())
+        order_ids = list(orders['OrderID'])
+
+        self.assertEqual(list(orders['Quantity']), [5, 20, 20])
+        self.assertEqual(order_ids, [order_ids[0], order_ids[0] + 'a', order_ids[0] + 'b'])
+        self.assertTrue(order_ids[0].endswith('_1'))
+
+    def test_welcome_orders_are_split(self):
+        orders = cascadia.append_order(1, 3, 8, self.address, set())
+        self.assertEqual(list(orders['Quantity']), [4, 4])
+
+    def test_orders_within_shipment_size_are_not_split(self):
+        orders = cascadia.append_order(1, 2, 1, self.address, set())
+        self.assertEqual(list(orders['Quantity']), [1])
+
+    def test_orders_without_address_are_skipped(self):
+        self.address[['Street Address', 'City', 'State']] = None
+        self.assertIsNone(cascadia.append_order(1, 1, 5, self.address, set()))
+
+
+class TestBuildHouseholdAddresses(unittest.TestCase):
+
+    def setUp(self):
+        def record(house_id, event, street, instrument=None, **fields):
+            return dict({
+                'house_id': house_id,
+                'event': event,
+                'redcap_repeat_instrument': instrument,
+                'HH Reporter': None,
+                'Project Name': None,
+                'ss_date_1': None,
+                'Street Address': street,
+                'Apt Number': None,
+                'City': 'Seattle',
+                'State': 'WA',
+                'Zipcode': 98101,
+                'Pref First Name': None,
+                'First Name': f'First {street}',
+                'Last Name': f'Last {street}',
+                'Email': f'{street}@enrollment',
+                'Phone': f'{street} phone',
+                'Delivery Instructions': f'{street} instructions',
+                'Street Address 2': None,
+                'Apt Number 2': None,
+                'City 2': None,
+                'State 2': None,
+                'Zipcode 2': None,
+            }, **fields)
+
+        survey = {
+            'Last Name': 'Survey',
+            'Email': 'survey@email',
+            'Phone': 'survey phone',
+            'Delivery Instructions': 'survey instructions',
+            'City 2': 'Portland',
+            'State 2': 'OR',
+            'Zipcode 2': 97201,
+        }
+        records = pd.DataFrame([
+            # household 1 has an older and a newer survey address
+            record(1, '0_arm_1', '1a', **{'Project Name': 2}),
+            record(1, '1_arm_1', '1b', **{'HH Reporter': 1, 'Pref First Name': 'P1'}),
+            record(1, '1_arm_1', None, 'symptom_survey', ss_date_1='2022-05-01',
+                   **dict(survey, **{'Street Address 2': 'old survey'})),
+            record(1, '1_arm_1', None, 'symptom_survey', ss_date_1='2022-05-06',
+                   **dict(survey, **{'Street Address 2': 'new survey'})),
+            # household 2 has only an incomplete survey address
+            record(2, '0_arm_1', '2a', **{'Project Name': 1}),
+            record(2, '1_arm_1', '2b', **{'HH Reporter': 1}),
+            record(2, '1_arm_1', None, 'symptom_survey', ss_date_1='2022-05-06',
+                   **{'Zipcode 2': 97201}),
+            # household 3 has no head of household and an unmapped project
+            record(3, '0_arm_1', '3a', **{'Project Name': 3}),
+            record(3, '1_arm_1', '3b'),
+        ]).set_index(['house_id', 'event'])
+        records['ss_date_1'] = pd.to_datetime(records['ss_date_1'])
+        self.addresses = cascadia.build_household_addresses(records).sort_index()
+
+    def test_most_recent_survey_address_is_used(self):
+        address = self.addresses.loc[1]
+        self.assertEqual(address['Street Address'], 'new survey')
+        self.assertEqual((address['City'], address['State'], address['Zipcode']), ('Portland', 'OR', 97201))
+
+    def test_head_of_household_enrollment_address_is_fallback(self):
+        self.assertEqual(self.addresses.loc[2, 'Street Address'], '2b')
+
+    def test_first_participant_is_fallback_head_of_household(self):
+        self.assertEqual(self.addresses.loc[3, 'Street Address'], '3a')
+
+    def test_contact_details_come_from_enrollment(self):
+        self.assertEqual(list(self.addresses['Pref First Name']), ['P1', 'First 2b', 'First 3a'])
+        self.assertEqual(list(self.addresses['Last Name']), ['Last 1b', 'Last 2b', 'Last 3a'])
+        self.assertEqual(list(self.addresses['Email']), ['1b@enrollment', '2b@enrollment', '3a@enrollment'])
+        self.assertEqual(list(self.addresses['Phone']), ['1b phone', '2b phone', '3a phone'])
+        self.assertEqual(list(self.addresses['Delivery Instructions']),
+                         ['1b instructions', '2b instructions', '3a instructions'])
+
+    def test_project_names_are_mapped(self):
+        self.assertEqual(list(self.addresses['Project Name'][:2]), ['Cascadia_SEA', 'Cascadia_PDX'])
+        self.assertTrue(pd.isna(self.addresses.loc[3, 'Project Name']))
+
+    def test_only_export_columns_are_kept(self):
+        self.assertTrue(set(self.addresses.columns).issubset(USPS_EXPORT_COLS))
+
+
+class TestOrderNumbers(unittest.TestCase):
+
+    def test_suffix_continues_past_z(self):
+        suffixes = [cascadia.order_number_suffix(attempt) for attempt in (1, 2, 26, 27, 28, 52, 53, 702, 703)]
+        self.assertEqual(suffixes, ['a', 'b', 'z', 'aa', 'ab', 'az', 'ba', 'zz', 'aaa'])
+
+    def test_generated_order_numbers_are_unique(self):
+        order_ids = set()
+        # pin the clock so the date prefix cannot change mid-test at midnight
+        with mock.patch.object(cascadia, 'datetime') as datetime:
+            datetime.datetime.now.return_value = real_datetime.datetime(2022, 5, 6, 23, 59, 59)
+            generated = [cascadia.generate_order_number(order_ids, 1) for _ in range(28)]
+
+        self.assertEqual(len(set(generated)), 28)
+        self.assertEqual(order_ids, set(generated))
+        self.assertEqual(generated[:3] + generated[26:],
+                         ['220506_1', '220506_1a', '220506_1b', '220506_1z', '220506_1aa'])
+
+
+class TestSelectMostRecent(unittest.TestCase):
+
+    def test_latest_timestamp_per_group(self):
+        group_codes = np.array([0, 1, 0, 1, 2])
+        timestamps = np.array([5, 3, 9, 4, 1])
+        self.assertEqual(list(cascadia.select_most_recent(group_codes, timestamps)), [2, 3, 4])
+
+    def test_ties_use_earliest_position(self):
+        group_codes = np.array([0, 0, 0])
+        timestamps = np.array([9, 5, 9])
+        self.assertEqual(list(cascadia.select_most_recent(group_codes, timestamps)), [0])
+
+    def test_missing_dates_only_used_as_fallback(self):
+        # NaT is stored as the smallest int64
+        dates = pd.to_datetime(pd.Series([None, '2022-05-06', None])).to_numpy(dtype='datetime64[ns]').view('int64')
+        group_codes = np.array([0, 0, 1])
+        self.assertEqual(list(cascadia.select_most_recent(group_codes, dates)), [1, 2])
+
+    def test_empty_input(self):
+        selected = cascadia.select_most_recent(np.array([], dtype=int), np.array([], dtype='int64'))
+        self.assertEqual(len(selected), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
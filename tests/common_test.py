@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import unittest
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+
+# pylint: disable=import-error, wrong-import-position
+from ordering.utils.common import use_best_addresses
+
+
+class TestUseBestAddresses(unittest.TestCase):
+
+    def setUp(self):
+        self.enrollments = pd.DataFrame(
+            {
+                'Street Address': ['1 Main St', '2 Main St', 'other event'],
+                'Apt Number': ['1', None, None],
+                'City': ['Seattle'] * 3,
+                'State': ['WA'] * 3,
+                'Zipcode': [98101] * 3,
+                'First Name': ['A', 'B', 'C'],
+                'Last Name': ['X', 'Y', 'Z'],
+                'Email': ['a@enrollment', 'b@enrollment', None],
+                'Phone': ['1', '2', None],
+                'Notification Pref': ['email', 'text', None],
+                'Project Name': ['Project', 'Project', None],
+            },
+            index=pd.MultiIndex.from_tuples([(1, 'enrollment_arm_1'), (2, 'enrollment_arm_1'),
+                                             (1, 'other_arm_1')]))
+        self.orders = pd.DataFrame(
+            {
+                'Street Address 2': ['1 New St', None],
+                'Apt Number 2': [None, None],
+                'City 2': ['Tacoma', None],
+                'State 2': ['WA', None],
+                'Zipcode 2': [98402, None],
+                'Email': [None, 'b@order'],
+            },
+            index=pd.MultiIndex.from_tuples([(1, 'kit_order_arm_1'), (2, 'kit_order_arm_1')]))
+
+    def test_event_joins_orders_to_enrollment_event(self):
+        updated = use_best_addresses(self.enrollments, self.orders, 'enrollment_arm_1')
+
+        self.assertTrue(updated.index.equals(self.orders.index))
+        self.assertEqual(list(updated['Street Address']), ['1 New St', '2 Main St'])
+        self.assertEqual(list(updated['City']), ['Tacoma', 'Seattle'])
+        self.assertEqual(list(updated['Zipcode']), [98402, 98101])
+
+    def test_replacement_address_is_used_whole(self):
+        updated = use_best_addresses(self.enrollments, self.orders, 'enrollment_arm_1')
+        self.assertTrue(pd.isna(updated['Apt Number'].iloc[0]))
+
+    def test_metadata_is_filled_from_enrollment(self):
+        updated = use_best_addresses(self.enrollments, self.orders, 'enrollment_arm_1')
+
+        self.assertEqual(list(updated['Email']), ['a@enrollment', 'b@order'])
+        self.assertEqual(list(updated['First Name']), ['A', 'B'])
+        self.assertEqual(list(updated['Notification Pref']), ['email', 'text'])
+
+    def test_orders_without_enrollment_are_kept(self):
+        orders = self.orders.set_axis(pd.MultiIndex.from_tuples([(3, 'kit_order_arm_1'), (2, 'kit_order_arm_1')]))
+        updated = use_best_addresses(self.enrollments, orders, 'enrollment_arm_1')
+
+        self.assertEqual(list(updated['Street Address']), ['1 New St', '2 Main St'])
+        self.assertTrue(pd.isna(updated['First Name'].iloc[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+import unittest
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root / 'update_dashboards'))
+
+# pylint: disable=import-error, wrong-import-position
+import tpchd
+
+
+class TestAgeBuckets(unittest.TestCase):
+
+    def test_age_boundaries(self):
+        ages = pd.Series(['-1', '0', '19', '20', '79', '80', '', 'abc'])
+        buckets = tpchd.get_age_buckets(ages)
+
+        self.assertEqual(list(buckets[:6]), [
+            'unknown', '0-19 years', '0-19 years', '20-29 years', '70-79 years', '80+ years'
+        ])
+        self.assertTrue(buckets[6:].isna().all())
+
+    def test_blank_and_non_numeric_ages_are_not_counted(self):
+        base = pd.DataFrame({
+            'illness_q_date': pd.to_datetime(['2022-05-06'] * 5),
+            'age': ['-1', '25', '27', pd.NA, 'abc'],
+        })
+        counts = tpchd.count_age_buckets(base)
+
+        self.assertEqual(list(counts['age bucket']), ['unknown', '20-29 years'])
+        self.assertEqual(list(counts['record_id']), [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
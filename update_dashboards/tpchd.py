@@ -6,8 +6,10 @@ import json
 import envdir
 import gspread
 import requests
-import xlsxwriter
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
+import numpy as np
 import pandas as pd
 from pathlib import Path
 from urllib.parse import urlparse
@@ -20,6 +22,13 @@ sys.path.append(base_dir)
 # pylint: disable=import-error, wrong-import-position
 from etc.scan_tphcd_dashboard_config import project_dict
 
+# age buckets are closed on the left, e.g. [20, 30) is '20-29 years'
+AGE_BUCKET_BINS = [-np.inf, 0, 20, 30, 40, 50, 60, 70, 80, np.inf]
+AGE_BUCKET_LABELS = [
+    'unknown', '0-19 years', '20-29 years', '30-39 years', '40-49 years',
+    '50-59 years', '60-69 years', '70-79 years', '80+ years'
+]
+
 
 def main():
     # config files for variable and zipcode mapping
@@ -38,20 +47,34 @@ def main():
     # Export all records from SCAN redcap
     print('Getting REDCap data')
     data = pd.DataFrame(get_redcap_data())
-    data = data.replace('', pd.NA)
+
+    # REDCap exports blank fields as empty strings, so only replace them within
+    # fields which may be blank. Parse illness dates once up front.
+    for col in ['home_zipcode_2', 'priority_code', 'age', 'date_tested', 'test_result']:
+        data[col] = data[col].replace('', pd.NA)
+    data['illness_q_date'] = pd.to_datetime(data['illness_q_date'],
+                                            format='%Y-%m-%d',
+                                            errors='coerce')
+    data = data.astype({'priority_code': 'category', 'test_result': 'category'})
 
     # Filter to pierce county by zipcode
     data = filter_pierce(data, zipcode_county_map)
 
-    # Import to SHARED_TPCHD_SCAN_Metrics Google Sheets
-    print('Importing data')
-    import_prio_code(data, sheet.worksheet('Priority Code'))
-    import_enrollment(data, sheet.worksheet('Enrollment'))
-    import_zipcode(data, sheet.worksheet('Zipcode'))
-    import_age(data, sheet.worksheet('Age'))
-    import_positive(data, sheet.worksheet('Positive'))
+    # All aggregations are by illness date, so drop records without one once
+    base = data.dropna(subset=['illness_q_date']).copy()
+
+    # Aggregate for the SHARED_TPCHD_SCAN_Metrics Google Sheets
+    print('Counting data')
+    named_frames = {
+        'Priority Code': count_priority_codes(base),
+        'Enrollment': count_enrollments(base),
+        'Zipcode': count_zipcodes(base),
+        'Age': count_age_buckets(base),
+        'Positive': count_positives(base)
+    }
+    update_sheets(sheet, named_frames)
 
-    download_data(sheet)
+    download_data(named_frames, get_sheet_headers(sheet, named_frames))
 
 
 def get_gspread_client(auth_file):
@@ -70,31 +93,35 @@ def get_redcap_data():
     ]
     projects = ['SCAN English', 'SCAN Spanish', 'SCAN Vietnamese']
     url = urlparse(os.environ.get("REDCAP_API_URL"))
-    data = []
-
-    for p in projects:
-        formData = {
-            'token':
-            os.environ.get(
-                f"REDCAP_API_TOKEN_{url.netloc}_{project_dict[p]['project_id']}"
-            ),
-            'content':
-            'record',
-            'format':
-            'json',
-            'type':
-            'flat',
-            'fields':
-            ",".join(map(str, export_feilds)),
-            'rawOrLabel':
-            'label',
-            'returnFormat':
-            'json',
-            'filterLogic':
-            '[event-name][illness_q_date] <> ""'
-        }
-        r = requests.post(url.geturl(), data=formData)
-        data.extend(r.json())
+
+    form_dicts = [{
+        'token':
+        os.environ.get(
+            f"REDCAP_API_TOKEN_{url.netloc}_{project_dict[p]['project_id']}"),
+        'content':
+        'record',
+        'format':
+        'json',
+        'type':
+        'flat',
+        'fields':
+        ",".join(map(str, export_feilds)),
+        'rawOrLabel':
+        'label',
+        'returnFormat':
+        'json',
+        'filterLogic':
+        '[event-name][illness_q_date] <> ""'
+    } for p in projects]
+
+    # request each project in parallel over a shared connection pool
+    with requests.Session() as session, ThreadPoolExecutor(
+            max_workers=len(form_dicts)) as executor:
+        session.headers.update({'Accept-Encoding': 'gzip'})
+        responses = executor.map(
+            lambda formData: session.post(url.geturl(), data=formData).json(),
+            form_dicts)
+        data = list(chain.from_iterable(responses))
     return (data)
 
 
@@ -109,72 +136,102 @@ def filter_pierce(data, zipcode_county_map):
     return (data)
 
 
-def import_prio_code(data, sheet):
-    print('Importing Priority Code Data')
-    data = data.dropna(subset=['priority_code']).groupby(
-        ['illness_q_date', 'priority_code'],
-        as_index=False).agg({'record_id': 'count'})
-    sheet.delete_rows(2, sheet.row_count)
-    sheet.append_rows(data.values.tolist(), value_input_option='USER_ENTERED')
-
-
-def import_enrollment(data, sheet):
-    print('Importing Enrollment Data')
-    data = data.dropna(subset=['illness_q_date']).groupby(
-        ['illness_q_date'], as_index=False).agg({'record_id': 'count'})
-    sheet.update('A2:B1000',
-                 data.values.tolist(),
-                 value_input_option='USER_ENTERED')
-
-
-def import_zipcode(data, sheet):
-    print('Importing Zipcode Data')
-    data = data.dropna(subset=['illness_q_date']).groupby(
-        ['illness_q_date', 'home_zipcode_2'],
-        as_index=False).agg({'record_id': 'count'})
-    sheet.delete_rows(2, sheet.row_count)
-    sheet.append_rows(data.values.tolist(), value_input_option='USER_ENTERED')
-
-
-def import_age(data, sheet):
-    print('Importing Age Data')
-    data['age bucket'] = data['age'].apply(
-        lambda row: get_age_bucket(int(row)))
-    data = data.dropna(subset=['illness_q_date']).groupby(
-        ['illness_q_date', 'age bucket'],
-        as_index=False).agg({'record_id': 'count'})
-    sheet.delete_rows(2, sheet.row_count)
-    sheet.append_rows(data.values.tolist(), value_input_option='USER_ENTERED')
-
-
-def import_positive(data, sheet):
-    print('Importing Positive Data')
-    data = data.dropna(subset=['test_result']).groupby(
-        ['illness_q_date', 'test_result'],
-        as_index=False).agg({'record_id': 'count'})
-    sheet.delete_rows(2, sheet.row_count)
-    sheet.append_rows(data.values.tolist(), value_input_option='USER_ENTERED')
-
-
-def get_age_bucket(age):
-    if age >= 80:
-        return ('80+ years')
-    elif age >= 70:
-        return ('70-79 years')
-    elif age >= 60:
-        return ('60-69 years')
-    elif age >= 50:
-        return ('50-59 years')
-    elif age >= 40:
-        return ('40-49 years')
-    elif age >= 30:
-        return ('30-39 years')
-    elif age >= 20:
-        return ('20-29 years')
-    elif age >= 0:
-        return ('0-19 years')
-    else:
-        return ('unknown')
+def count_records(base, groups):
+    '''Count the records in `base` within each of the passed `groups`'''
+    return base.groupby(groups,
+                        observed=True).size().reset_index(name='record_id')
+
+
+def count_priority_codes(base):
+    print('Counting Priority Code Data')
+    return count_records(base, ['illness_q_date', 'priority_code'])
+
+
+def count_enrollments(base):
+    print('Counting Enrollment Data')
+    return count_records(base, ['illness_q_date'])
+
+
+def count_zipcodes(base):
+    print('Counting Zipcode Data')
+    return count_records(base, ['illness_q_date', 'home_zipcode_2'])
+
+
+def count_age_buckets(base):
+    print('Counting Age Data')
+    return count_records(base.assign(**{'age bucket': get_age_buckets(base['age'])}),
+                         ['illness_q_date', 'age bucket'])
+
+
+def get_age_buckets(ages):
+    '''
+    Bucket `ages` by decade. Negative ages are 'unknown', while blank or
+    non-numeric ages are left empty and so are not counted.
+    '''
+    return pd.cut(pd.to_numeric(ages, errors='coerce'),
+                  bins=AGE_BUCKET_BINS,
+                  labels=AGE_BUCKET_LABELS,
+                  right=False)
+
+
+def count_positives(base):
+    print('Counting Positive Data')
+    return count_records(base, ['illness_q_date', 'test_result'])
+
+
+def update_sheets(google_workbook, named_frames):
+    '''
+    Replace the columns each named data frame owns below the header row of its
+    worksheet. Any columns past the data frame's width are left untouched. All
+    worksheets are cleared in one request and written in another.
+    '''
+    print('Updating Google Sheets')
+    worksheets = {
+        worksheet.title: worksheet
+        for worksheet in google_workbook.worksheets()
+    }
+    for title in worksheets.keys() - named_frames.keys():
+        print(f'Warning: worksheet <{title}> is not updated or exported')
+
+    google_workbook.batch_update({
+        'requests': [{
+            'updateCells': {
+                'range': {
+                    'sheetId': worksheets[title].id,
+                    'startRowIndex': 1,
+                    'startColumnIndex': 0,
+                    'endColumnIndex': len(data.columns)
+                },
+                'fields': 'userEnteredValue'
+            }
+        } for title, data in named_frames.items()]
+    })
+    google_workbook.values_batch_update(
+        body={
+            'valueInputOption':
+            'USER_ENTERED',
+            'data': [{
+                'range': f"'{title}'!A2",
+                'values': sheet_values(data)
+            } for title, data in named_frames.items()]
+        })
+
+
+def get_sheet_headers(google_workbook, titles):
+    '''Get the header row of each of the titled worksheets in one request'''
+    value_ranges = google_workbook.values_batch_get(
+        [f"'{title}'!1:1" for title in titles])['valueRanges']
+
+    return {
+        title: value_range.get('values', [[]])[0]
+        for title, value_range in zip(titles, value_ranges)
+    }
+
+
+def sheet_values(data):
+    '''Format aggregated `data` as rows of JSON serializable sheet values'''
+    return data.assign(illness_q_date=data['illness_q_date'].dt.strftime(
+        '%Y-%m-%d')).values.tolist()
 
 
 #find next available row in a given sheet
@@ -184,20 +241,29 @@ def next_available_row(worksheet):
 
 
 #download the data in .xlsx format to be sent as attachment in weekly email
-def download_data(google_workbook):
+def download_data(named_frames, headers):
     print('Exporting to .xlsx')
-    google_sheet_list = google_workbook.worksheets()
     today = dt.now().strftime('%Y_%m_%d')
 
-    with xlsxwriter.Workbook(
-            os.path.join(base_dir, f'data/SCAN_TPCHD_{today}.xlsx'),
-        {'strings_to_numbers': True}) as xlsx_workbook:
-        for sheet in google_sheet_list:
-            list_of_rows = sheet.get_all_values()
-            worksheet = xlsx_workbook.add_worksheet(sheet.title)
-
-            for row_num, data in enumerate(list_of_rows):
-                worksheet.write_row(row_num, 0, data)
+    with pd.ExcelWriter(os.path.join(base_dir,
+                                     f'data/SCAN_TPCHD_{today}.xlsx'),
+                        engine='xlsxwriter',
+                        date_format='YYYY-MM-DD',
+                        datetime_format='YYYY-MM-DD',
+                        engine_kwargs={'options': {
+                            'strings_to_numbers': True
+                        }}) as writer:
+        for title, data in named_frames.items():
+            # label columns with the worksheet headers, falling back on the
+            # column name if a worksheet has fewer headers than columns
+            columns = list(data.columns)
+            if len(headers[title]) > len(columns):
+                print(f'Warning: dropping headers {headers[title][len(columns):]} '
+                      f'from <{title}> export')
+            columns[:len(headers[title])] = headers[title][:len(columns)]
+            data.set_axis(columns, axis=1).to_excel(writer,
+                                                   sheet_name=title,
+                                                   index=False)
 
 
 if __name__ == "__main__":